@@ -9,6 +9,7 @@ from flask import Flask, render_template, request, redirect, url_for, session, j
 from flask_socketio import SocketIO, emit, join_room, leave_room, disconnect
 from flask_cors import CORS
 from flask_sock import Sock
+from werkzeug.security import check_password_hash
 from message_store import MessageStore
 import subprocess
 
@@ -29,21 +30,31 @@ socketio = SocketIO(
     max_http_buffer_size=50 * 1024 * 1024,  # 50MB for large video files
     ping_timeout=60,  # Increase timeout for large file transfers
     ping_interval=25,  # Keep default ping interval
-    async_mode='eventlet'  # Use eventlet for better async support
+    async_mode='threading'  # Matches the gthread gunicorn workers; SQLite calls block a thread, not an event loop
 )
 
 # --- In-Memory Storage (For Prototype / Stealth) ---
 # In a real production scenario with multiple workers, use Redis.
+# Passwords stored as werkzeug scrypt hashes, never in plaintext.
 users = {
-    "sana": "13851208",
-    "ayhan": "512683"
+    "sana": "scrypt:32768:8:1$XxaVoRhn9D0fdZrP$bfb61a7379c9e98e1cde72339aed544422d3b4915ce6a797a60569ece91e73f82e951911a6884d472735703df62cb8e78c8fe202f29dbd3eadd0887d074e6e21",
+    "ayhan": "scrypt:32768:8:1$fC4gN2lAjHQkQuzK$faeb7e8fc797f4144eb58d2d844ddd918fd0c870fa635cb0590f76b9d1415caa8a4bd49b92741b4b9a1397a3410c4b36c370af3a7f5941c0e8471f0f25a8f16a"
 }
 
+def check_password(username, password):
+    """Verify a login attempt against the stored password hash"""
+    password_hash = users.get(username)
+    return password_hash is not None and check_password_hash(password_hash, password)
+
 # Active sessions: {session_id: username}
 active_sessions = {}
 
-# Blocked IPs: {ip_address: expiry_timestamp}
+# Blocked IPs: {ip_address: time.monotonic() deadline}
 blocked_ips = {}
+# Frozen snapshot of blocked_ips keys, rebuilt only when blocks change.
+# The common case (nobody blocked) is then a single membership test against
+# an empty frozenset on every request.
+_blocked_set = frozenset()
 
 # Message Storage (500MB limit with auto-cleanup)
 message_store = MessageStore()
@@ -105,15 +116,26 @@ def threaded_telegram_send(chat_id, message, sid):
 # --- Middleware / Helpers ---
 
 def is_blocked(ip):
-    if ip in blocked_ips:
-        if datetime.now() < blocked_ips[ip]:
-            return True
-        else:
-            del blocked_ips[ip]
+    # Runs on every request: one frozenset membership test rejects the
+    # common case before touching the deadline dict. get/pop instead of
+    # [] / del: under gthread two requests can race the same expiry, and
+    # the loser must not 500 on a key the winner already removed
+    if ip not in _blocked_set:
+        return False
+    deadline = blocked_ips.get(ip)
+    if deadline is not None and time.monotonic() < deadline:
+        return True
+    blocked_ips.pop(ip, None)
+    _rebuild_blocked_set()
     return False
 
 def block_ip(ip, duration_minutes=5):
-    blocked_ips[ip] = datetime.now() + timedelta(minutes=duration_minutes)
+    blocked_ips[ip] = time.monotonic() + duration_minutes * 60
+    _rebuild_blocked_set()
+
+def _rebuild_blocked_set():
+    global _blocked_set
+    _blocked_set = frozenset(blocked_ips)
 
 @app.before_request
 def check_block():
@@ -139,7 +161,7 @@ def login():
         username = request.form.get('username')
         password = request.form.get('password')
         
-        if username in users and users[username] == password:
+        if username and password and check_password(username, password):
             session['user'] = username
             if request.headers.get('Accept') == 'application/json':
                 return jsonify({'status': 'success', 'user': username})
@@ -175,7 +197,9 @@ def health_check():
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
         'active_sessions': len(active_sessions),
-        'blocked_ips': len([ip for ip, expiry in blocked_ips.items() if datetime.now() < expiry])
+        # Snapshot the values: is_blocked on another thread may pop an
+        # expired entry mid-iteration
+        'blocked_ips': len([expiry for expiry in list(blocked_ips.values()) if time.monotonic() < expiry])
     }), 200
 
 @app.route('/api/status')
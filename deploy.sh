@@ -149,8 +149,8 @@ else
     # Run Flask App (using Gunicorn if available, else python)
     if command -v gunicorn &> /dev/null; then
         log_info "Starting Server with Gunicorn..."
-        # 1 worker, eventlet worker class for socketio support
-        exec gunicorn --worker-class eventlet -w 1 --bind 0.0.0.0:3002 app:app
+        # Single gthread worker (see gunicorn_config.py) for socketio support
+        exec gunicorn -c "$PROJECT_DIR/gunicorn_config.py" app:app
     else
         log_info "Gunicorn not found, starting with Python..."
         exec python app.py
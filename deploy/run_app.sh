@@ -19,4 +19,4 @@ if sudo lsof -i :5000 > /dev/null; then
 fi
 
 # Run with Gunicorn (Production)
-gunicorn --worker-class eventlet -w 1 --bind 0.0.0.0:5000 app:app
+gunicorn -c gunicorn_config.py --bind 0.0.0.0:5000 app:app
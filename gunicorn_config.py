@@ -1,12 +1,21 @@
-import os
-
 bind = "0.0.0.0:3002"
+# Flask-SocketIO keeps rooms, active_sessions and broadcasts in-process
+# and there is no message queue wired up, so the app must stay a single
+# worker. gthread still gives request concurrency via threads, and a
+# blocking SQLite call stalls one thread instead of a whole event loop
+# (as the previous eventlet worker did).
 workers = 1
-worker_class = "eventlet"
-threads = 1
+worker_class = "gthread"
+threads = 8
 timeout = 120
 keepalive = 5
 
+# No preload: the app must be imported after fork so MessageStore's
+# writer thread and SQLite connection are created in the worker process.
+# Threads do not survive fork, and SQLite forbids carrying a connection
+# across one.
+preload_app = False
+
 # Logging
 accesslog = "-"
 errorlog = "-"
@@ -4,7 +4,11 @@ Uses SQLite (file-based, no server needed)
 """
 import sqlite3
 import os
+import time
+import atexit
+import queue
 import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 from datetime import datetime
 from typing import Optional, List, Dict
 
@@ -12,21 +16,88 @@ from typing import Optional, List, Dict
 MAX_DB_SIZE_MB = 500
 MAX_DB_SIZE_BYTES = MAX_DB_SIZE_MB * 1024 * 1024
 
+# Write buffer: flush after this many pending messages or this many seconds,
+# whichever comes first. Batching inserts into one transaction amortizes the
+# commit cost across messages.
+FLUSH_MAX_PENDING = 100
+FLUSH_INTERVAL_S = 0.01
+
+# Pages reclaimed per incremental_vacuum call (512 pages ≈ 2MB at the
+# default 4KB page size) — bounds cleanup latency instead of rewriting
+# the whole file like a full VACUUM would
+INCREMENTAL_VACUUM_PAGES = 512
+
+# Sample the database size once per this many writes rather than on
+# every insert
+SIZE_CHECK_EVERY = 64
+
 class MessageStore:
     """Manages message storage with automatic cleanup"""
-    
+
+    # Hot-path SQL kept as stable literals so sqlite3's internal prepared-
+    # statement cache always hits instead of re-parsing and re-planning
+    _SQL_INSERT = '''
+        INSERT INTO messages (user, message, message_type, timestamp, created_at, reply_to)
+        VALUES (?, ?, ?, ?, ?, ?)
+    '''
+    _SQL_SELECT_BY_ID = '''
+        SELECT id, user, message AS msg, message_type AS type, timestamp, created_at, reply_to
+        FROM messages
+        WHERE id = ?
+    '''
+
     def __init__(self, db_path: str = 'messages.db'):
         self.db_path = db_path
         self.lock = threading.Lock()
+        # Single long-lived connection shared by all methods (serialized by
+        # self.lock); avoids re-opening the database and re-applying PRAGMAs
+        # on every call. The background cleanup thread opens its own.
+        self._conn = self._connect()
+        self._writes_since_size_check = 0
+        self._page_size = 4096  # real value fetched in _init_database
+        # Single-slot guard: at most one background cleanup thread at a time
+        self._cleanup_running = threading.Event()
         self._init_database()
         self._check_and_cleanup()
-    
+        # All writes funnel through one background writer thread pulling
+        # (row, future) pairs off this queue in batches
+        self._write_q: queue.Queue = queue.Queue()
+        self._writer = threading.Thread(target=self._writer_loop, daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open a connection with the performance PRAGMAs applied"""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None,
+                               cached_statements=512)
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        # WAL lets readers run while a write is in progress and avoids the
+        # fsync-per-commit cost of the default rollback journal.
+        # journal_mode=WAL persists in the database file, but re-issuing it
+        # is cheap and keeps fresh databases correct.
+        cursor.execute('PRAGMA journal_mode=WAL')
+        # The remaining PRAGMAs are per-connection
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute('PRAGMA temp_store=MEMORY')
+        cursor.execute('PRAGMA cache_size=-64000')  # 64MB page cache
+        cursor.execute('PRAGMA mmap_size=268435456')  # 256MB memory-mapped I/O
+        return conn
+
     def _init_database(self):
         """Initialize the database schema"""
         with self.lock:
-            conn = sqlite3.connect(self.db_path, check_same_thread=False)
-            cursor = conn.cursor()
-            
+            cursor = self._conn.cursor()
+
+            # Use incremental auto-vacuum so cleanup can reclaim space a few
+            # pages at a time instead of rewriting the whole database file
+            cursor.execute('PRAGMA auto_vacuum')
+            if cursor.fetchone()[0] != 2:  # 2 = INCREMENTAL
+                cursor.execute('PRAGMA auto_vacuum=INCREMENTAL')
+                # On an existing database the mode change only takes effect
+                # after a one-time full VACUUM
+                cursor.execute('VACUUM')
+
             # Create messages table
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS messages (
@@ -52,15 +123,44 @@ class MessageStore:
             cursor.execute('''
                 CREATE INDEX IF NOT EXISTS idx_timestamp ON messages(timestamp)
             ''')
+
+            # Covering index for the ORDER BY timestamp DESC read paths:
+            # includes every projected column so SQLite can answer the hot
+            # queries index-only, without touching the table B-tree
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_msgs_cover
+                ON messages(timestamp DESC, id, user, message, message_type, created_at, reply_to)
+            ''')
             
-            conn.commit()
-            conn.close()
-    
+            cursor.execute('PRAGMA page_size')
+            self._page_size = cursor.fetchone()[0]
+
+            # Seed query-planner statistics the first time we open an
+            # existing non-empty database; PRAGMA optimize keeps them
+            # fresh from then on
+            cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'sqlite_stat1'")
+            has_stats = cursor.fetchone()[0]
+            if not has_stats:
+                cursor.execute('SELECT EXISTS(SELECT 1 FROM messages)')
+                if cursor.fetchone()[0]:
+                    cursor.execute('ANALYZE messages')
+
+            self._conn.commit()
+
     def _get_db_size(self) -> int:
         """Get current database file size in bytes"""
         if os.path.exists(self.db_path):
             return os.path.getsize(self.db_path)
         return 0
+
+    def _db_size(self, cursor) -> int:
+        """Committed database size from SQLite's own page accounting
+
+        Cheaper than a stat() syscall, and accurate under WAL where the
+        file size lags behind committed data until checkpoint.
+        """
+        cursor.execute('PRAGMA page_count')
+        return cursor.fetchone()[0] * self._page_size
     
     def _check_and_cleanup(self):
         """Check database size and cleanup if needed"""
@@ -71,36 +171,57 @@ class MessageStore:
             self._cleanup_oldest_messages()
     
     def _cleanup_oldest_messages(self):
-        """Remove oldest messages until under size limit"""
+        """Remove oldest messages until live data is under 90% of the limit"""
         with self.lock:
-            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            # Dedicated connection: this runs on a background thread
+            conn = self._connect()
             try:
                 cursor = conn.cursor()
+
+                # Trim the oldest rows in one range DELETE (clean until 90% of
+                # limit). Size the overshoot against live pages only:
+                # page_count includes freelist pages from earlier deletes,
+                # which the vacuum loop below reclaims — counting them would
+                # keep deleting live rows long after the data is under limit.
+                cursor.execute('PRAGMA freelist_count')
+                free_pages = cursor.fetchone()[0]
+                size = self._db_size(cursor) - free_pages * self._page_size
+                if size > MAX_DB_SIZE_BYTES * 0.9:
+                    cursor.execute('SELECT COUNT(*) FROM messages')
+                    total = cursor.fetchone()[0]
+
+                    if total > 0:
+                        # Rows to drop, proportional to the overshoot
+                        excess = 1 - (MAX_DB_SIZE_BYTES * 0.9) / size
+                        to_delete = max(1, int(total * excess))
+
+                        # Boundary timestamp of the Nth-oldest message, then
+                        # one DELETE instead of SELECT+IN-list batches
+                        cursor.execute('''
+                            SELECT timestamp FROM messages
+                            ORDER BY timestamp ASC
+                            LIMIT 1 OFFSET ?
+                        ''', (to_delete - 1,))
+                        boundary = cursor.fetchone()
+
+                        if boundary is not None:
+                            cursor.execute('DELETE FROM messages WHERE timestamp <= ?', (boundary[0],))
+                            conn.commit()
+                            print(f"🗑️ Deleted {cursor.rowcount} oldest messages")
                 
-                # Delete oldest 10% of messages at a time
-                while self._get_db_size() > MAX_DB_SIZE_BYTES * 0.9:  # Clean until 90% of limit
-                    cursor.execute('''
-                        SELECT id FROM messages 
-                        ORDER BY timestamp ASC 
-                        LIMIT 100
-                    ''')
-                    ids_to_delete = [row[0] for row in cursor.fetchall()]
-                    
-                    if not ids_to_delete:
+                # Reclaim the freed pages in bounded slices until the
+                # freelist drains; each slice is small, so no single call
+                # rewrites the entire file the way a full VACUUM would
+                while True:
+                    cursor.execute(f'PRAGMA incremental_vacuum({INCREMENTAL_VACUUM_PAGES})')
+                    cursor.execute('PRAGMA freelist_count')
+                    if cursor.fetchone()[0] == 0:
                         break
-                    
-                    placeholders = ','.join('?' * len(ids_to_delete))
-                    cursor.execute(f'DELETE FROM messages WHERE id IN ({placeholders})', ids_to_delete)
-                    conn.commit()
-                    
-                    print(f"🗑️ Deleted {len(ids_to_delete)} oldest messages")
-                
-                # Vacuum to reclaim space
-                # Switch to autocommit mode for VACUUM
-                conn.isolation_level = None
-                cursor.execute('VACUUM')
+
+                # Refresh planner statistics after the bulk delete
+                cursor.execute('PRAGMA optimize')
                 
-                final_size = self._get_db_size()
+                final_size = self._db_size(cursor)
                 print(f"✅ Cleanup complete. Database size: {final_size / 1024 / 1024:.2f}MB")
             except Exception as e:
                 print(f"❌ Error in cleanup: {e}")
@@ -108,175 +229,211 @@ class MessageStore:
                 conn.close()
     
     def save_message(self, user: str, message: str, message_type: str = 'text', timestamp: Optional[float] = None, reply_to: Optional[int] = None) -> int:
-        """Save a message and return its ID"""
+        """Save a message and return its ID
+
+        Messages are handed to a dedicated writer thread that batches them
+        into one transaction per flush window; this call blocks until the
+        batch containing this message has committed.
+        """
         if timestamp is None:
             timestamp = datetime.now().timestamp()
-        
+
+        future: Future = Future()
+        row = (user, message, message_type, timestamp, datetime.now().isoformat(), reply_to)
+        self._write_q.put((row, future))
+
+        # Resolved by the writer thread (at most FLUSH_INTERVAL_S away).
+        # Bounded wait so a dead writer — e.g. the store was created before
+        # a fork and the thread did not survive it — raises instead of
+        # hanging the caller forever.
+        while True:
+            try:
+                return future.result(timeout=1.0)
+            except FutureTimeoutError:
+                if not self._writer.is_alive():
+                    raise RuntimeError('MessageStore writer thread is not running')
+
+    def _writer_loop(self):
+        """Single-writer thread: drain the queue in batches
+
+        SQLite allows only one writer at a time even under WAL, so all
+        inserts funnel through this thread; each batch commits in one
+        transaction while readers proceed concurrently.
+        """
+        while True:
+            item = self._write_q.get()
+            batch = [item]
+
+            if item is not None:
+                # Gather whatever else arrives within the flush window
+                deadline = time.monotonic() + FLUSH_INTERVAL_S
+                while len(batch) < FLUSH_MAX_PENDING:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(self._write_q.get(timeout=timeout))
+                    except queue.Empty:
+                        break
+
+            # The close() sentinel can land anywhere in the batch when a
+            # save_message races close(); flush every real row either way,
+            # then exit
+            stop = None in batch
+            pending = [entry for entry in batch if entry is not None]
+            if pending:
+                self._write_batch(pending)
+            for _ in batch:
+                self._write_q.task_done()
+            if stop:
+                return
+
+    def _write_batch(self, pending):
+        """Commit a batch of (row, future) pairs in a single transaction"""
         with self.lock:
-            conn = sqlite3.connect(self.db_path, check_same_thread=False)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT INTO messages (user, message, message_type, timestamp, created_at, reply_to)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (user, message, message_type, timestamp, datetime.now().isoformat(), reply_to))
-            
-            message_id = cursor.lastrowid
-            conn.commit()
-            conn.close()
-            
-            # Check size after each save (async cleanup)
-            if self._get_db_size() > MAX_DB_SIZE_BYTES:
-                # Run cleanup in background thread to not block
-                threading.Thread(target=self._cleanup_oldest_messages, daemon=True).start()
-            
-            return message_id
+            cursor = self._conn.cursor()
+
+            try:
+                cursor.execute('BEGIN')
+                cursor.executemany(self._SQL_INSERT, [row for row, _ in pending])
+                self._conn.commit()
+            except Exception as e:
+                self._conn.rollback()
+                for _, future in pending:
+                    future.set_exception(e)
+                return
+
+            # Rowids are assigned sequentially within the transaction
+            cursor.execute('SELECT last_insert_rowid()')
+            last_id = cursor.fetchone()[0]
+            first_id = last_id - len(pending) + 1
+            for i, (_, future) in enumerate(pending):
+                future.set_result(first_id + i)
+
+            # Sample the size once per SIZE_CHECK_EVERY writes rather than
+            # checking after every batch (async cleanup)
+            self._writes_since_size_check += len(pending)
+            if self._writes_since_size_check >= SIZE_CHECK_EVERY:
+                self._writes_since_size_check = 0
+                if self._db_size(cursor) > MAX_DB_SIZE_BYTES and not self._cleanup_running.is_set():
+                    # Run cleanup in a background thread to not block; the
+                    # event keeps a burst of over-limit batches from stacking
+                    # up threads that would all serialize on self.lock
+                    self._cleanup_running.set()
+                    threading.Thread(target=self._cleanup_wrapper, daemon=True).start()
+
+    def _cleanup_wrapper(self):
+        """Run cleanup and release the single cleanup slot"""
+        try:
+            self._cleanup_oldest_messages()
+        finally:
+            self._cleanup_running.clear()
     
     def get_recent_messages(self, limit: int = 50) -> List[Dict]:
         """Get recent messages"""
         with self.lock:
-            conn = sqlite3.connect(self.db_path, check_same_thread=False)
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
+            cursor = self._conn.cursor()
             
+            # Subquery picks the newest rows, outer ORDER BY hands them back
+            # already in chronological order — no Python-side reversal
             cursor.execute('''
-                SELECT id, user, message, message_type, timestamp, created_at, reply_to
-                FROM messages
-                ORDER BY timestamp DESC
-                LIMIT ?
+                SELECT id, user, message AS msg, message_type AS type, timestamp, created_at, reply_to
+                FROM (
+                    SELECT id, user, message, message_type, timestamp, created_at, reply_to
+                    FROM messages
+                    ORDER BY timestamp DESC
+                    LIMIT ?
+                )
+                ORDER BY timestamp ASC
             ''', (limit,))
             
-            messages = []
-            for row in cursor.fetchall():
-                messages.append({
-                    'id': row['id'],
-                    'user': row['user'],
-                    'msg': row['message'],
-                    'type': row['message_type'],
-                    'timestamp': row['timestamp'],
-                    'created_at': row['created_at'],
-                    'reply_to': row['reply_to']
-                })
+            # dict(row) is C-implemented and the SQL aliases already match
+            # the wire-format keys, so no per-column lookups here
+            messages = [dict(row) for row in cursor.fetchall()]
             
-            conn.close()
-            return list(reversed(messages))  # Return in chronological order
+            return messages  # Already in chronological order
     
     def get_messages_paginated(self, limit: int = 50, offset: int = 0) -> List[Dict]:
         """Get messages with pagination support"""
         with self.lock:
-            conn = sqlite3.connect(self.db_path, check_same_thread=False)
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
+            cursor = self._conn.cursor()
             
             cursor.execute('''
-                SELECT id, user, message, message_type, timestamp, created_at, reply_to
-                FROM messages
-                ORDER BY timestamp DESC
-                LIMIT ? OFFSET ?
+                SELECT id, user, message AS msg, message_type AS type, timestamp, created_at, reply_to
+                FROM (
+                    SELECT id, user, message, message_type, timestamp, created_at, reply_to
+                    FROM messages
+                    ORDER BY timestamp DESC
+                    LIMIT ? OFFSET ?
+                )
+                ORDER BY timestamp ASC
             ''', (limit, offset))
             
-            messages = []
-            for row in cursor.fetchall():
-                messages.append({
-                    'id': row['id'],
-                    'user': row['user'],
-                    'msg': row['message'],
-                    'type': row['message_type'],
-                    'timestamp': row['timestamp'],
-                    'created_at': row['created_at'],
-                    'reply_to': row['reply_to']
-                })
+            # dict(row) is C-implemented and the SQL aliases already match
+            # the wire-format keys, so no per-column lookups here
+            messages = [dict(row) for row in cursor.fetchall()]
             
-            conn.close()
-            return list(reversed(messages))  # Return in chronological order
+            return messages  # Already in chronological order
     
     def get_messages_before(self, before_timestamp: float, limit: int = 50) -> List[Dict]:
         """Get messages before a specific timestamp"""
         with self.lock:
-            conn = sqlite3.connect(self.db_path, check_same_thread=False)
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
+            cursor = self._conn.cursor()
             
             cursor.execute('''
-                SELECT id, user, message, message_type, timestamp, created_at, reply_to
-                FROM messages
-                WHERE timestamp < ?
-                ORDER BY timestamp DESC
-                LIMIT ?
+                SELECT id, user, message AS msg, message_type AS type, timestamp, created_at, reply_to
+                FROM (
+                    SELECT id, user, message, message_type, timestamp, created_at, reply_to
+                    FROM messages
+                    WHERE timestamp < ?
+                    ORDER BY timestamp DESC
+                    LIMIT ?
+                )
+                ORDER BY timestamp ASC
             ''', (before_timestamp, limit))
             
-            messages = []
-            for row in cursor.fetchall():
-                messages.append({
-                    'id': row['id'],
-                    'user': row['user'],
-                    'msg': row['message'],
-                    'type': row['message_type'],
-                    'timestamp': row['timestamp'],
-                    'created_at': row['created_at'],
-                    'reply_to': row['reply_to']
-                })
+            # dict(row) is C-implemented and the SQL aliases already match
+            # the wire-format keys, so no per-column lookups here
+            messages = [dict(row) for row in cursor.fetchall()]
             
-            conn.close()
-            return list(reversed(messages))  # Return in chronological order
+            return messages  # Already in chronological order
     
     def get_message_by_id(self, message_id: int) -> Optional[Dict]:
         """Get a specific message by ID (for reply context)"""
         with self.lock:
-            conn = sqlite3.connect(self.db_path, check_same_thread=False)
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
+            cursor = self._conn.cursor()
             
-            cursor.execute('''
-                SELECT id, user, message, message_type, timestamp, created_at, reply_to
-                FROM messages
-                WHERE id = ?
-            ''', (message_id,))
+            cursor.execute(self._SQL_SELECT_BY_ID, (message_id,))
             
             row = cursor.fetchone()
-            conn.close()
             
             if row:
-                return {
-                    'id': row['id'],
-                    'user': row['user'],
-                    'msg': row['message'],
-                    'type': row['message_type'],
-                    'timestamp': row['timestamp'],
-                    'created_at': row['created_at'],
-                    'reply_to': row['reply_to']
-                }
+                return dict(row)
             return None
     
     def clear_all(self):
         """Clear all messages (for self-destruct)"""
+        # Let the writer drain anything already queued first (must happen
+        # outside self.lock — the writer needs it to commit)
+        self._write_q.join()
         with self.lock:
-            conn = sqlite3.connect(self.db_path, check_same_thread=False)
             try:
-                cursor = conn.cursor()
+                cursor = self._conn.cursor()
                 cursor.execute('DELETE FROM messages')
-                conn.commit() # Commit the deletion first
-                
-                # VACUUM must be run outside of a transaction
-                # Switch to autocommit mode for VACUUM
-                conn.isolation_level = None
-                cursor.execute('VACUUM')
-                
-                # Restore default isolation level (optional, but good practice if we reused conn)
-                conn.isolation_level = '' 
-                
+                self._conn.commit() # Commit the deletion first
+
+                # Reclaim freed pages incrementally rather than via full VACUUM
+                cursor.execute(f'PRAGMA incremental_vacuum({INCREMENTAL_VACUUM_PAGES})')
+
                 print("🗑️ All messages cleared")
             except Exception as e:
                 print(f"❌ Error in clear_all: {e}")
                 raise e
-            finally:
-                conn.close()
     
     def get_stats(self) -> Dict:
         """Get database statistics"""
         with self.lock:
-            conn = sqlite3.connect(self.db_path, check_same_thread=False)
-            cursor = conn.cursor()
+            cursor = self._conn.cursor()
             
             cursor.execute('SELECT COUNT(*) FROM messages')
             count = cursor.fetchone()[0]
@@ -286,8 +443,6 @@ class MessageStore:
             oldest = result[0] if result[0] else None
             newest = result[1] if result[1] else None
             
-            conn.close()
-            
             size = self._get_db_size()
             
             return {
@@ -299,3 +454,21 @@ class MessageStore:
                 'newest_timestamp': newest
             }
 
+    def close(self):
+        """Stop the writer, flush queued writes and close the shared connection (also registered via atexit)"""
+        if self._writer.is_alive():
+            self._write_q.put(None)  # sentinel: flush remaining and exit
+            self._writer.join(timeout=5)
+            if self._writer.is_alive():
+                # Never close the connection under a still-running writer;
+                # leaking it beats crashing the next batch mid-commit
+                print("⚠️ Writer thread did not stop; leaving connection open")
+                return
+        with self.lock:
+            if self._conn is not None:
+                # Near-free planner-statistics upkeep recommended by SQLite
+                # for long-lived connections at close time
+                self._conn.execute('PRAGMA optimize')
+                self._conn.close()
+                self._conn = None
+
@@ -6,6 +6,12 @@ import socket
 import threading
 import os
 import random
+import asyncio
+import concurrent.futures
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
 
 # Configuration
 TEST_URL = "https://api.telegram.org"
@@ -18,50 +24,188 @@ PROXY_SOURCES = [
     "https://raw.githubusercontent.com/jetkai/proxy-list/main/online-proxies/txt/proxies-http.txt"
 ]
 STATUS_FILE = "/dev/shm/tg_proxy_status"
+SCORE_FILE = "/dev/shm/tg_proxy_scores.json"
+# Drop remembered proxies not seen working for a day
+SCORE_MAX_AGE_S = 24 * 3600
 # Target 90ms but allow up to 2 seconds for a working path
-LATENCY_TARGET = 0.090 
+LATENCY_TARGET = 0.090
 LATENCY_MAX = 2.0
+# Concurrent probing: each test can block up to 3s on the network, so a
+# serial scan of 100 proxies could take minutes. On asyncio each probe is
+# just an epoll fd, so the whole pool can be scanned in one pass.
+SCAN_CANDIDATES = 1000
+SCAN_CONCURRENCY = 500
+# Only the best TCP-ranked proxies get the full HTTPS validation
+VALIDATE_TOP = 20
 
 class ProxyManager:
     def __init__(self):
         self.active_proxy = None
         self.proxies = []
         self.lock = threading.Lock()
+        # Shared session for the periodic health check so it reuses sockets
+        # instead of rebuilding an opener (and its TCP/TLS state) per test
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=8)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        # Known-good proxies with an EMA of their measured latency, persisted
+        # so a restart starts from what already worked instead of rescanning
+        # from scratch
+        self._scores = self._load_scores()
         
+    def _fetch_source(self, index, source):
+        try:
+            # Use a User-Agent to avoid being blocked by GitHub/ProxyScrape
+            req = urllib.request.Request(source, headers={'User-Agent': 'Mozilla/5.0'})
+            with urllib.request.urlopen(req, timeout=15) as response:
+                content = response.read().decode('utf-8', errors='ignore')
+            # Pre-parse once into (host, port, url) so the scan loops never
+            # redo the split or the f-string per probe
+            found = set()
+            for line in content.splitlines():
+                line = line.strip()
+                if line and ":" in line and not line.startswith("#"):
+                    host, _, port = line.partition(":")
+                    try:
+                        found.add((host, int(port), f"http://{line}"))
+                    except ValueError:
+                        continue
+            print(f"Source {index+1}: Found {len(found)} proxies")
+            return found
+        except Exception as e:
+            print(f"Source {index+1} FAILED: {e}")
+            return set()
+
     def fetch_proxies(self):
         print(f"[{time.ctime()}] Fetching proxy list from {len(PROXY_SOURCES)} sources...")
         new_proxies = set()
-        for i, source in enumerate(PROXY_SOURCES):
-            try:
-                # Use a User-Agent to avoid being blocked by GitHub/ProxyScrape
-                req = urllib.request.Request(source, headers={'User-Agent': 'Mozilla/5.0'})
-                with urllib.request.urlopen(req, timeout=15) as response:
-                    content = response.read().decode('utf-8', errors='ignore')
-                    found = 0
-                    for line in content.splitlines():
-                        line = line.strip()
-                        if line and ":" in line and not line.startswith("#"):
-                            new_proxies.add(line)
-                            found += 1
-                    print(f"Source {i+1}: Found {found} proxies")
-            except Exception as e:
-                print(f"Source {i+1} FAILED: {e}")
-        
+        # Download all sources in parallel instead of one 15s timeout at a time
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(PROXY_SOURCES)) as executor:
+            for found in executor.map(self._fetch_source, range(len(PROXY_SOURCES)), PROXY_SOURCES):
+                new_proxies.update(found)
+
         with self.lock:
             self.proxies = list(new_proxies)
         print(f"Total unique proxies in pool: {len(self.proxies)}")
 
-    def test_proxy(self, proxy_addr):
-        proxy_url = f"http://{proxy_addr}"
+    def _load_scores(self):
+        try:
+            with open(SCORE_FILE) as f:
+                scores = json.load(f)
+            cutoff = time.time() - SCORE_MAX_AGE_S
+            return {addr: s for addr, s in scores.items() if s.get("ts", 0) >= cutoff}
+        except (OSError, ValueError):
+            return {}
+
+    def _save_scores(self):
+        try:
+            tmp = SCORE_FILE + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(self._scores, f)
+            # Atomic on the same tmpfs: readers see old or new, never partial
+            os.replace(tmp, SCORE_FILE)
+        except OSError as e:
+            print(f"Could not persist proxy scores: {e}")
+
+    def _update_score(self, proxy_addr, latency):
+        old = self._scores.get(proxy_addr)
+        if old:
+            # Exponential moving average smooths out one-off spikes
+            latency = 0.7 * old["latency"] + 0.3 * latency
+        self._scores[proxy_addr] = {"latency": latency, "ts": time.time()}
+        self._save_scores()
+
+    async def _tcp_ping_async(self, proxy, sem):
+        """Raw TCP connect to the proxy itself.
+
+        Measures pure network latency to the proxy, without the TLS
+        handshake and Telegram RTT that dominate a full HTTPS test.
+        """
+        host, port, _ = proxy
+        async with sem:
+            try:
+                start_time = time.time()
+                _, writer = await asyncio.wait_for(
+                    asyncio.open_connection(host, port), timeout=1)
+                latency = time.time() - start_time
+                writer.close()
+                return latency
+            except (OSError, asyncio.TimeoutError):
+                return None
+
+    async def _validate_async(self, session, proxy):
+        """Full HTTPS validation through the proxy (stage 2)"""
+        _, _, proxy_url = proxy
         try:
             start_time = time.time()
-            proxy_handler = urllib.request.ProxyHandler({'http': proxy_url, 'https': proxy_url})
-            opener = urllib.request.build_opener(proxy_handler)
-            # Short timeout to keep the search moving
-            with opener.open(TEST_URL, timeout=3) as response:
+            # aiohttp's head also defaults to not following redirects, and
+            # api.telegram.org redirects the bare root — follow it so a
+            # working proxy can actually produce a 200
+            async with session.head(TEST_URL, proxy=proxy_url,
+                                    allow_redirects=True) as response:
                 latency = time.time() - start_time
-                if response.getcode() == 200:
-                    return latency
+                if response.status == 200:
+                    self._update_score(proxy_url, latency)
+                    return latency, proxy_url
+        except Exception:
+            pass
+        return None
+
+    async def _scan_async(self, candidates):
+        """Two-stage scan: rank every candidate by raw TCP latency, then
+        validate the best-ranked over HTTPS. Returns the best proxy URL."""
+        sem = asyncio.Semaphore(SCAN_CONCURRENCY)
+        pings = await asyncio.gather(*[self._tcp_ping_async(p, sem) for p in candidates])
+        reachable = sorted(
+            (latency, proxy) for latency, proxy in zip(pings, candidates)
+            if latency is not None
+        )
+        print(f"  TCP stage: {len(reachable)} of {len(candidates)} reachable.")
+
+        best_proxy = None
+        min_latency = float('inf')
+        connector = aiohttp.TCPConnector(limit=VALIDATE_TOP, ssl=False)
+        timeout = aiohttp.ClientTimeout(total=3)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            tasks = [asyncio.ensure_future(self._validate_async(session, proxy))
+                     for _, proxy in reachable[:VALIDATE_TOP]]
+            for future in asyncio.as_completed(tasks):
+                result = await future
+                if result is None:
+                    continue
+                latency, proxy_url = result
+                print(f"  FOUND: {proxy_url} ({latency*1000:.1f}ms)")
+                if latency < min_latency:
+                    min_latency = latency
+                    best_proxy = proxy_url
+
+                # Stop if we hit the user's high-speed target
+                if latency < LATENCY_TARGET:
+                    print(f"  Target latency met ({latency*1000:.1f}ms). Stopping search.")
+                    for task in tasks:
+                        task.cancel()
+                    break
+        return best_proxy
+
+    def test_proxy(self, proxy):
+        _, _, proxy_url = proxy
+        try:
+            start_time = time.time()
+            # HEAD keeps response-body bytes off the wire; short timeout to
+            # keep the search moving. Session.head defaults to not following
+            # redirects, but api.telegram.org answers the bare root with one,
+            # so follow it or no probe ever sees a 200.
+            response = self._session.head(
+                TEST_URL,
+                proxies={'http': proxy_url, 'https': proxy_url},
+                timeout=3,
+                allow_redirects=True
+            )
+            latency = time.time() - start_time
+            if response.status_code == 200:
+                self._update_score(proxy_url, latency)
+                return latency
         except:
             pass
         return None
@@ -77,28 +221,25 @@ class ProxyManager:
             with self.lock:
                 candidates = self.proxies[:]
         
-        random.shuffle(candidates)
-        
-        best_proxy = None
-        min_latency = float('inf')
-        tested_count = 0
-        
-        # Test up to 100 proxies per scan
-        for proxy_addr in candidates[:100]:
-            tested_count += 1
-            latency = self.test_proxy(proxy_addr)
-            if latency is not None:
-                print(f"  FOUND: {proxy_addr} ({latency*1000:.1f}ms)")
-                if latency < min_latency:
-                    min_latency = latency
-                    best_proxy = f"http://{proxy_addr}"
-                
-                # Stop if we hit the user's high-speed target
-                if latency < LATENCY_TARGET:
-                    print(f"  Target latency met ({latency*1000:.1f}ms). Stopping search.")
-                    break
-        
-        print(f"Scan complete. Tested {tested_count} proxies.")
+        # Previously-good proxies first (best remembered latency), then a
+        # random sample of the unknowns for exploration. random.sample picks
+        # only the entries we need in O(k) instead of shuffling the whole
+        # pool just to use its head.
+        known = [proxy for proxy in candidates if proxy[2] in self._scores]
+        known.sort(key=lambda proxy: self._scores[proxy[2]]["latency"])
+        known = known[:SCAN_CANDIDATES]
+
+        remaining = SCAN_CANDIDATES - len(known)
+        if remaining > 0:
+            unknown = [proxy for proxy in candidates if proxy[2] not in self._scores]
+            unknown = random.sample(unknown, min(remaining, len(unknown)))
+        else:
+            unknown = []
+
+        candidates = known + unknown
+        best_proxy = asyncio.run(self._scan_async(candidates))
+
+        print(f"Scan complete. Tested {len(candidates)} proxies.")
         if best_proxy:
             self.set_active_proxy(best_proxy)
         else:
@@ -106,11 +247,18 @@ class ProxyManager:
             self.set_active_proxy("") 
 
     def set_active_proxy(self, proxy_url):
+        # Health checks call this every cycle; skip the write when nothing
+        # changed so readers never race a needless truncate+rewrite
+        if proxy_url == self.active_proxy:
+            return
         self.active_proxy = proxy_url
         try:
-            # Write to file for app.py to read
-            with open(STATUS_FILE, "w") as f:
+            # Write-to-temp + rename so app.py sees either the old or the
+            # new content, never an empty file mid-write
+            tmp = STATUS_FILE + ".tmp"
+            with open(tmp, "w") as f:
                 f.write(proxy_url)
+            os.replace(tmp, STATUS_FILE)
             print(f"ACTIVE PROXY UPDATED: {proxy_url if proxy_url else 'NONE'}")
         except Exception as e:
             print(f"Critical error writing status file: {e}")
@@ -125,7 +273,9 @@ class ProxyManager:
                     needs_new = True
                 else:
                     # Test current active proxy
-                    latency = self.test_proxy(self.active_proxy.replace("http://", ""))
+                    addr = self.active_proxy.replace("http://", "")
+                    host, _, port = addr.partition(":")
+                    latency = self.test_proxy((host, int(port), self.active_proxy))
                     if latency is None:
                         print("Active proxy is dead. Rotating...")
                         needs_new = True
@@ -43,7 +43,7 @@ pkill -f "app:app" || true
 sleep 2 # Wait for ports to clear
 
 # Start Gunicorn in Daemon mode
-"$VENV_DIR/bin/gunicorn" -D -k eventlet -w 1 -b 0.0.0.0:3002 app:app
+"$VENV_DIR/bin/gunicorn" -D -c "$APP_DIR/gunicorn_config.py" app:app
 
 echo "=========================================="
 echo "   Update Complete! System is Live."